@@ -1,66 +1,114 @@
 """Agent optimizer implementation"""
 import logging
 import re
-from typing import Dict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
 
 from app.agents.strategies import OptimizationStrategy
-from app.services.gemini_service import gemini_service
 from app.services.hybrid_search import hybrid_search
-from app.core.database import db
 
 logger = logging.getLogger(__name__)
 
+# agent_results columns filled by AgentOutcome.row, in order; rows are
+# bulk-loaded with COPY, and completed_at is left to its NOW() default
+RESULT_COLUMNS = [
+    "task_id", "fork_id", "agent_id", "strategy", "optimized_code",
+    "improvement_percent", "error_message", "status",
+]
+
+_PCT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*%')
+_MUL_RE = re.compile(r'(\d+(?:\.\d+)?)\s*x')
+
+# Standard improvement values for complexity reductions, keyed on
+# (quadratic before, linearithmic after, linear after)
+_COMPLEXITY_GAINS = {
+    (True, True, True): 50.0,   # Quadratic to linearithmic
+    (True, True, False): 50.0,  # Quadratic to linearithmic
+    (True, False, True): 75.0,  # Quadratic to linear
+}
+
+
+@dataclass
+class AgentOutcome:
+    """Result of a single agent run and the agent_results row recording it"""
+    data: Dict
+    row: tuple
+    
+    @property
+    def completed(self) -> bool:
+        return self.data["status"] == "completed"
+
 
 class AgentOptimizer:
     """Individual agent that applies an optimization strategy"""
     
-    def __init__(self, agent_id: str, fork_id: str, strategy: OptimizationStrategy):
+    def __init__(
+        self,
+        agent_id: str,
+        fork_id: str,
+        strategy: OptimizationStrategy,
+        patterns: Optional[List[Dict]] = None
+    ):
         self.agent_id = agent_id
         self.fork_id = fork_id
         self.strategy = strategy
+        # Pre-fetched hybrid search results shared by agents of the same category
+        self.patterns = patterns
     
-    async def optimize(self, code: str, task_id: str) -> Dict:
+    async def build_prompt(self, code: str) -> str:
         """
-        Run optimization on isolated fork
+        Build the Gemini prompt for this agent's strategy
         
         Args:
             code: Code to optimize
-            task_id: Task ID for tracking
             
         Returns:
-            Dict with optimization results
+            Prompt string including any relevant pattern context
         """
-        try:
-            logger.info(f"🤖 Agent {self.agent_id} starting optimization with strategy: {self.strategy.name}")
-            
-            # 1. Search for relevant patterns using hybrid search
-            logger.info(f"🔍 Agent {self.agent_id} searching for relevant patterns...")
+        logger.info("🤖 Agent %s starting optimization with strategy: %s", self.agent_id, self.strategy.name)
+        
+        # 1. Search for relevant patterns using hybrid search, unless shared results were provided
+        relevant_patterns = self.patterns
+        if relevant_patterns is None:
+            logger.info("🔍 Agent %s searching for relevant patterns...", self.agent_id)
             relevant_patterns = await hybrid_search(
                 query_text=code[:500],  # Use first 500 chars for search
-                category=self.strategy.category.value,
+                category=self.strategy.category_value,
                 limit=3
             )
-            logger.info(f"📚 Agent {self.agent_id} found {len(relevant_patterns) if relevant_patterns else 0} relevant patterns")
-            logger.info(f"📚 Agent {self.agent_id} found {len(relevant_patterns) if relevant_patterns else 0} relevant patterns")
-            
-            # 2. Build context from relevant patterns
-            context = self._build_context(relevant_patterns)
-            
-            # 3. Create prompt with strategy template
-            logger.info(f"💭 Agent {self.agent_id} building prompt...")
-            prompt = self.strategy.prompt_template.format(code=code)
-            
-            # Add context if patterns found
-            if context:
-                prompt = f"Context - Similar optimization patterns:\n{context}\n\n{prompt}"
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("📚 Agent %s found %d relevant patterns", self.agent_id, len(relevant_patterns) if relevant_patterns else 0)
+        
+        # 2. Build context from relevant patterns
+        context = self._build_context(relevant_patterns)
+        
+        # 3. Create prompt with strategy template
+        logger.info("💭 Agent %s building prompt...", self.agent_id)
+        prompt = self.strategy.build(code)
+        
+        # Add context if patterns found
+        if context:
+            prompt = f"Context - Similar optimization patterns:\n{context}\n\n{prompt}"
+        
+        return prompt
+    
+    def process_result(self, result, task_id: str) -> AgentOutcome:
+        """
+        Parse a Gemini response for this agent
+        
+        Args:
+            result: Parsed Gemini response for this agent's prompt
+            task_id: Task ID for tracking
             
-            # 4. Get optimization from Gemini
-            logger.info(f"🤔 Agent {self.agent_id} calling Gemini API...")
-            result = await gemini_service.optimize_code(prompt)
-            logger.info(f"✨ Agent {self.agent_id} received Gemini response (type={type(result)})")
+        Returns:
+            AgentOutcome with optimization results
+        """
+        try:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("✨ Agent %s received Gemini response (type=%s)", self.agent_id, type(result))
             # Defensive: if model returned a list, convert to dict
             if isinstance(result, list):
-                logger.warning(f"Gemini returned a list for agent {self.agent_id}; converting to dict")
+                logger.warning("Gemini returned a list for agent %s; converting to dict", self.agent_id)
                 if len(result) > 0 and isinstance(result[0], dict):
                     result = result[0]
                 else:
@@ -76,52 +124,48 @@ class AgentOptimizer:
                 "0%"
             )
             
-            logger.info(f"📊 Agent {self.agent_id} parsed improvement: {improvement}%")
+            logger.info("📊 Agent %s parsed improvement: %s%%", self.agent_id, improvement)
             
-            # 6. Store result in database
-            logger.info(f"💾 Agent {self.agent_id} storing result in database...")
-            await db.execute("""
-                INSERT INTO agent_results 
-                (task_id, fork_id, agent_id, strategy, original_code, optimized_code, 
-                 improvement_percent, status, completed_at)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, 'completed', NOW())
-            """, task_id, self.fork_id, self.agent_id, self.strategy.name,
-                code, result.get('optimized_code'), improvement)
+            logger.info("✅ Agent %s completed successfully with %s%% improvement", self.agent_id, improvement)
             
-            logger.info(f"✅ Agent {self.agent_id} completed successfully with {improvement}% improvement")
-            
-            return {
+            data = {
                 "agent_id": self.agent_id,
                 "strategy": self.strategy.name,
-                "category": self.strategy.category.value,
+                "category": self.strategy.category_value,
                 "optimized_code": result.get('optimized_code'),
                 "explanation": result.get('explanation', ''),
                 "improvement_percent": improvement,
                 "status": "completed"
             }
+            row = (task_id, self.fork_id, self.agent_id, self.strategy.name,
+                   data["optimized_code"], improvement, None, "completed")
+            return AgentOutcome(data, row)
             
         except Exception as e:
-            logger.error(f"❌ Agent {self.agent_id} failed with error: {str(e)}", exc_info=True)
-            
-            # Store error in database
-            try:
-                await db.execute("""
-                    INSERT INTO agent_results 
-                    (task_id, fork_id, agent_id, strategy, original_code, 
-                     error_message, status, completed_at)
-                    VALUES ($1, $2, $3, $4, $5, $6, 'failed', NOW())
-                """, task_id, self.fork_id, self.agent_id, self.strategy.name,
-                    code, str(e))
-                logger.info(f"💾 Agent {self.agent_id} error stored in database")
-            except Exception as db_error:
-                logger.error(f"❌ Agent {self.agent_id} failed to store error in database: {db_error}")
+            return self.failure(task_id, e)
+    
+    def failure(self, task_id: str, error: BaseException) -> AgentOutcome:
+        """
+        Build the outcome for a failed agent run
+        
+        Args:
+            task_id: Task ID for tracking
+            error: Exception that stopped the agent
             
-            return {
-                "agent_id": self.agent_id,
-                "strategy": self.strategy.name,
-                "error": str(e),
-                "status": "failed"
-            }
+        Returns:
+            AgentOutcome describing the failure
+        """
+        logger.error("❌ Agent %s failed with error: %s", self.agent_id, error, exc_info=error)
+        
+        data = {
+            "agent_id": self.agent_id,
+            "strategy": self.strategy.name,
+            "error": str(error),
+            "status": "failed"
+        }
+        row = (task_id, self.fork_id, self.agent_id, self.strategy.name,
+               None, None, str(error), "failed")
+        return AgentOutcome(data, row)
     
     def _build_context(self, patterns: list) -> str:
         """Build context string from relevant patterns"""
@@ -138,42 +182,49 @@ class AgentOptimizer:
         
         return "\n".join(context_parts)
     
-    def _parse_improvement(self, improvement_str: str) -> float:
+    def _parse_improvement(self, improvement: Union[str, int, float]) -> float:
         """
-        Parse improvement percentage from various string formats
+        Parse improvement percentage from a number or various string formats
         
         Args:
-            improvement_str: String like '40%', '2x faster', '50% reduction'
+            improvement: Number like 42.5, or string like '40%', '2x faster', '50% reduction'
             
         Returns:
             Float percentage value
         """
+        # Fast paths for the common shapes: a bare number or a plain "40%"
+        if isinstance(improvement, (int, float)) and not isinstance(improvement, bool):
+            return float(improvement)
+        if not isinstance(improvement, str) or not improvement:
+            return 0.0
+        if improvement.endswith('%'):
+            try:
+                return float(improvement[:-1].strip())
+            except ValueError:
+                pass
+        
         try:
+            s = improvement.lower()
+            
             # Handle percentage format: "40%"
-            if '%' in improvement_str:
-                match = re.search(r'(\d+(?:\.\d+)?)', improvement_str)
-                if match:
-                    return float(match.group(1))
+            match = _PCT_RE.search(s)
+            if match:
+                return float(match.group(1))
             
             # Handle multiplier format: "2x faster", "3.5x"
-            if 'x' in improvement_str.lower():
-                match = re.search(r'(\d+(?:\.\d+)?)\s*x', improvement_str.lower())
-                if match:
-                    # Convert multiplier to percentage (2x = 100%, 3x = 200%)
-                    return (float(match.group(1)) - 1) * 100
+            match = _MUL_RE.search(s)
+            if match:
+                # Convert multiplier to percentage (2x = 100%, 3x = 200%)
+                return (float(match.group(1)) - 1) * 100
             
             # Handle "O(n²) to O(n)" complexity improvements
-            if 'o(' in improvement_str.lower():
-                # Assign standard improvement values for complexity reductions
-                if 'n²' in improvement_str.lower() or 'n^2' in improvement_str.lower():
-                    if 'n log n' in improvement_str.lower():
-                        return 50.0  # Quadratic to linearithmic
-                    elif 'o(n)' in improvement_str.lower():
-                        return 75.0  # Quadratic to linear
-                
+            if 'o(' in s:
+                key = ('n²' in s or 'n^2' in s, 'n log n' in s, 'o(n)' in s)
+                return _COMPLEXITY_GAINS.get(key, 0.0)
+            
             # Default to 0 if no improvement detected
             return 0.0
             
         except Exception as e:
-            logger.warning(f"Failed to parse improvement '{improvement_str}': {e}")
+            logger.warning("Failed to parse improvement '%s': %s", improvement, e)
             return 0.0
@@ -1,5 +1,5 @@
 """Agent optimization strategies"""
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 
 
@@ -19,6 +19,22 @@ class OptimizationStrategy:
     name: str
     category: StrategyCategory
     prompt_template: str
+    category_value: str = field(init=False, repr=False)
+    _prompt_prefix: str = field(init=False, repr=False)
+    _prompt_suffix: str = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        # Plain str copy of the category, read on every agent's hot path
+        self.category_value = self.category.value
+        # Split the template around its single {code} placeholder and unescape
+        # literal braces once, so build() is plain concatenation
+        prefix, suffix = self.prompt_template.split("{code}", 1)
+        self._prompt_prefix = prefix.replace("{{", "{").replace("}}", "}")
+        self._prompt_suffix = suffix.replace("{{", "{").replace("}}", "}")
+    
+    def build(self, code: str) -> str:
+        """Render the prompt template for code (same as prompt_template.format(code=code))"""
+        return self._prompt_prefix + code + self._prompt_suffix
 
 
 # Define all optimization strategies
@@ -1,15 +1,19 @@
 """Optimization API endpoints"""
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 import uuid
 import asyncio
+import hashlib
+import itertools
 import logging
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 from app.config import settings
 from app.agents.strategies import STRATEGIES
-from app.agents.optimizer import AgentOptimizer
+from app.agents.optimizer import AgentOptimizer, AgentOutcome, RESULT_COLUMNS
 from app.services.fork_manager import ForkManager
+from app.services.gemini_service import gemini_service
+from app.services.hybrid_search import hybrid_search_multi
 from app.core.database import db
 from app.main import manager
 
@@ -17,6 +21,11 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Caps how many optimization tasks run at once; extra tasks wait their turn
+_task_semaphore = asyncio.Semaphore(settings.max_concurrent_tasks)
+# Strong references to running tasks so they are not garbage collected mid-run
+_background_tasks: Set[asyncio.Task] = set()
+
 
 class OptimizationRequest(BaseModel):
     """Request model for optimization"""
@@ -40,13 +49,12 @@ class OptimizationResponse(BaseModel):
 
 
 @router.post("/optimize", response_model=OptimizationResponse)
-async def optimize_code(req: OptimizationRequest, bg_tasks: BackgroundTasks):
+async def optimize_code(req: OptimizationRequest):
     """
     Start code optimization with multiple parallel agents
     
     Args:
         req: Optimization request with code and parameters
-        bg_tasks: Background tasks handler
         
     Returns:
         Task information including WebSocket URL for real-time updates
@@ -62,14 +70,17 @@ async def optimize_code(req: OptimizationRequest, bg_tasks: BackgroundTasks):
             VALUES ($1, $2, $3, $4, 'pending')
         """, task_id, req.code, req.language, req.num_agents)
         
-        # Start optimization in background
-        bg_tasks.add_task(
-            run_optimization, 
-            task_id, 
-            req.code, 
-            req.language, 
-            req.num_agents
+        # Start optimization in background, bounded by settings.max_concurrent_tasks
+        task = asyncio.create_task(
+            run_optimization_bounded(
+                task_id, 
+                req.code, 
+                req.language, 
+                req.num_agents
+            )
         )
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
         
         return OptimizationResponse(
             task_id=task_id,
@@ -117,15 +128,17 @@ async def get_task_status(task_id: str):
         # Find best result
         best_result = None
         if results:
-            for result in results:
-                if result['improvement_percent'] and result['improvement_percent'] > 0:
-                    best_result_full = await db.fetchrow(
-                        """SELECT * FROM agent_results 
-                           WHERE task_id = $1 AND agent_id = $2""",
-                        task_id, result['agent_id']
-                    )
-                    best_result = dict(best_result_full)
-                    break
+            best_result_row = await db.fetchrow(
+                """SELECT * FROM agent_results 
+                   WHERE task_id = $1 AND status = 'completed' AND improvement_percent > 0
+                   ORDER BY improvement_percent DESC NULLS LAST
+                   LIMIT 1""",
+                task_id
+            )
+            if best_result_row:
+                best_result = dict(best_result_row)
+                # Source code is stored once on the task, not per agent result
+                best_result['original_code'] = task['original_code']
         
         return {
             "task_id": task_id,
@@ -145,6 +158,39 @@ async def get_task_status(task_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def run_agent_batch(
+    batch: List[Tuple[str, List[AgentOptimizer]]],
+    task_id: str
+) -> List[AgentOutcome]:
+    """
+    Run a batch of distinct prompts through a single Gemini request
+    
+    Args:
+        batch: (prompt, agents) pairs; every agent sharing a prompt gets its response
+        task_id: Task UUID
+        
+    Returns:
+        AgentOutcome for every agent in the batch
+    """
+    try:
+        responses = await gemini_service.optimize_batch([prompt for prompt, _ in batch])
+    except Exception as e:
+        logger.exception(f"Gemini batch of {len(batch)} prompts raised exception: {e}")
+        return [agent.failure(task_id, e) for _, group in batch for agent in group]
+    
+    return [
+        agent.process_result(response, task_id)
+        for (_, group), response in zip(batch, responses)
+        for agent in group
+    ]
+
+
+async def run_optimization_bounded(task_id: str, code: str, language: str, num_agents: int):
+    """Run an optimization task once a concurrent task slot is free"""
+    async with _task_semaphore:
+        await run_optimization(task_id, code, language, num_agents)
+
+
 async def run_optimization(task_id: str, code: str, language: str, num_agents: int):
     """
     Background task to run optimization with multiple agents
@@ -155,6 +201,8 @@ async def run_optimization(task_id: str, code: str, language: str, num_agents: i
         language: Programming language
         num_agents: Number of agents to use
     """
+    fork_manager: Optional[ForkManager] = None
+    fork_ids: List[str] = []
     try:
         logger.info(f"Starting optimization task {task_id}")
         
@@ -165,74 +213,139 @@ async def run_optimization(task_id: str, code: str, language: str, num_agents: i
         )
         
         # Broadcast start message
-        await manager.broadcast(task_id, {
-            "type": "status",
-            "data": {"status": "running"}
-        })
+        if manager.has_subscribers(task_id):
+            await manager.broadcast(task_id, {
+                "type": "status",
+                "data": {"status": "running"}
+            })
         
         # Create fork manager
         fork_manager = ForkManager(settings.tiger_service_name)
         
+        # Virtual forks all read the main database, so agents can share one
+        # fork per strategy instead of getting a fork each
+        share_forks = settings.fork_sharing_enabled and fork_manager.use_virtual_forks
+        num_forks = min(num_agents, len(STRATEGIES)) if share_forks else num_agents
+        
         # Create parallel forks (virtual on free tier)
-        logger.info(f"Creating {num_agents} forks...")
-        fork_ids = await fork_manager.create_parallel_forks(num_agents)
+        logger.info(f"Creating {num_forks} forks...")
+        fork_ids = await fork_manager.create_parallel_forks(num_forks)
         
         logger.info(f"Fork IDs returned: {fork_ids}")
         if not fork_ids:
             raise Exception("Failed to create any forks")
         
-        # Create agents with different strategies
+        # Strategies and shared forks cycle with the same period, so every
+        # agent of a strategy lands on that strategy's fork
+        agent_fork_ids = (
+            list(itertools.islice(itertools.cycle(fork_ids), num_agents))
+            if share_forks else fork_ids
+        )
+        
+        # Search patterns for all categories in one query; every agent of a
+        # category shares the same query (first 500 chars of the code)
+        categories = list(dict.fromkeys(
+            strategy.category_value for strategy in STRATEGIES[:len(agent_fork_ids)]
+        ))
+        patterns_by_category = await hybrid_search_multi(
+            query_text=code[:500],
+            categories=categories,
+            limit_per=3
+        )
+        
+        # Create agents with different strategies, assigned round-robin
+        strategies = itertools.islice(itertools.cycle(STRATEGIES), len(agent_fork_ids))
         agents = []
-        for i, fork_id in enumerate(fork_ids):
-            strategy = STRATEGIES[i % len(STRATEGIES)]
-            agent = AgentOptimizer(f"agent-{i}", fork_id, strategy)
+        for i, (fork_id, strategy) in enumerate(zip(agent_fork_ids, strategies)):
+            agent = AgentOptimizer(
+                f"agent-{i}", fork_id, strategy,
+                patterns=patterns_by_category[strategy.category_value]
+            )
             agents.append(agent)
         
         logger.info(f"Starting {len(agents)} agents...")
         
-        # Run all agents in parallel
-        results = await asyncio.gather(
-            *[agent.optimize(code, task_id) for agent in agents],
+        # Build every agent's prompt, then collapse identical prompts so each
+        # distinct prompt is sent to Gemini only once and fanned out to all
+        # agents sharing it (they still get their own agent_results rows)
+        prompts = await asyncio.gather(
+            *[agent.build_prompt(code) for agent in agents],
             return_exceptions=True
         )
+        prompt_failures: List[AgentOutcome] = []
+        prompt_groups: Dict[bytes, Tuple[str, List[AgentOptimizer]]] = {}
+        for agent, prompt in zip(agents, prompts):
+            if isinstance(prompt, Exception):
+                prompt_failures.append(agent.failure(task_id, prompt))
+                continue
+            key = hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+            prompt_groups.setdefault(key, (prompt, []))[1].append(agent)
+        groups = list(prompt_groups.values())
+        
+        # Marshal the distinct prompts into batched Gemini requests, never more
+        # per request than the output budget covers at full per-prompt length
+        batch_size = max(1, min(settings.gemini_batch_size, gemini_service.max_batch_prompts))
+        # Spread prompts evenly so every batch (and its streamed results)
+        # finishes at a similar time, e.g. 5 prompts -> 3 + 2 rather than 4 + 1
+        num_batches = -(-len(groups) // batch_size)
+        if num_batches:
+            batch_size = -(-len(groups) // num_batches)
+        batches = [groups[start:start + batch_size] for start in range(0, len(groups), batch_size)]
+        
+        logger.info(
+            f"Dispatching {len(groups)} distinct prompts for {len(agents)} agents "
+            f"in {len(batches)} Gemini batches (batch size {batch_size})"
+        )
         
         # Process and broadcast results
         successful_results = []
-        logger.info(f"Raw agent results (len={len(results)}): {results}")
-        for idx, result in enumerate(results):
-            # If the task raised an exception (unexpected), log detailed info
-            if isinstance(result, Exception):
-                logger.exception(f"Agent index {idx} raised exception: {result}")
-                # Insert a failed result record for visibility
-                try:
-                    await db.execute(
-                        """
-                        INSERT INTO agent_results (task_id, fork_id, agent_id, strategy, original_code, error_message, status, completed_at)
-                        VALUES ($1, $2, $3, $4, $5, $6, 'failed', NOW())
-                        """,
-                        task_id,
-                        agents[idx].fork_id if idx < len(agents) else 'unknown',
-                        agents[idx].agent_id if idx < len(agents) else f'agent-{idx}',
-                        agents[idx].strategy.name if idx < len(agents) else 'unknown',
-                        code,
-                        str(result)
-                    )
-                except Exception:
-                    logger.exception("Failed to record agent exception to DB")
-                continue
-
-            # Normal successful dict result from AgentOptimizer.optimize
-            successful_results.append(result)
-
+        outcomes: List[AgentOutcome] = []
+        
+        async def publish(outcome: AgentOutcome):
+            """Collect an agent outcome and broadcast it to subscribers"""
+            outcomes.append(outcome)
+            successful_results.append(outcome.data)
+            
             # Broadcast individual agent completion
+            if not manager.has_subscribers(task_id):
+                return
             try:
                 await manager.broadcast(task_id, {
                     "type": "agent_completed",
-                    "data": result
+                    "data": outcome.data
                 })
             except Exception:
                 logger.exception("Failed to broadcast agent result")
         
+        for outcome in prompt_failures:
+            await publish(outcome)
+        
+        # Run all batches in parallel and stream each batch's results as soon
+        # as it finishes, rather than after the slowest batch
+        pending = [asyncio.create_task(run_agent_batch(batch, task_id)) for batch in batches]
+        for next_batch in asyncio.as_completed(pending):
+            for outcome in await next_batch:
+                await publish(outcome)
+        
+        # Bulk-load all agent results (completed and failed) with binary COPY.
+        # The COPY is all-or-nothing, so a failure fails the whole task rather
+        # than marking it completed with no stored results
+        if outcomes:
+            try:
+                await db.copy_records_to_table(
+                    "agent_results",
+                    records=[outcome.row for outcome in outcomes],
+                    columns=RESULT_COLUMNS
+                )
+            except Exception:
+                logger.exception("Failed to store agent results")
+                raise
+            completed_count = sum(1 for outcome in outcomes if outcome.completed)
+            logger.info(
+                f"💾 Stored {completed_count} completed and "
+                f"{len(outcomes) - completed_count} failed agent results"
+            )
+        
         # Find best result
         best_result = None
         best_improvement = -1
@@ -244,39 +357,29 @@ async def run_optimization(task_id: str, code: str, language: str, num_agents: i
                     best_improvement = improvement
                     best_result = result
         
-        # Update task with best result
-        if best_result:
-            best_result_id = await db.fetchval(
-                """SELECT id FROM agent_results 
-                   WHERE task_id = $1 AND agent_id = $2""",
-                task_id, best_result['agent_id']
-            )
-            
-            await db.execute(
-                """UPDATE optimization_tasks 
-                   SET status = 'completed', best_result_id = $2, completed_at = NOW()
-                   WHERE id = $1""",
-                task_id, best_result_id
-            )
-        else:
-            await db.execute(
-                "UPDATE optimization_tasks SET status = 'completed', completed_at = NOW() WHERE id = $1",
-                task_id
-            )
+        # Update task with best result, resolving its row id in the same statement
+        await db.execute(
+            """UPDATE optimization_tasks 
+               SET status = 'completed', completed_at = NOW(),
+                   best_result_id = (
+                       SELECT id FROM agent_results
+                       WHERE task_id = $1 AND agent_id = $2
+                       LIMIT 1
+                   )
+               WHERE id = $1""",
+            task_id, best_result['agent_id'] if best_result else None
+        )
         
         # Broadcast completion
-        await manager.broadcast(task_id, {
-            "type": "completion",
-            "message": "Optimization completed",
-            "best_result": best_result
-        })
+        if manager.has_subscribers(task_id):
+            await manager.broadcast(task_id, {
+                "type": "completion",
+                "message": "Optimization completed",
+                "best_result": best_result
+            })
         
         logger.info(f"✅ Optimization task {task_id} completed. Best improvement: {best_improvement}%")
         
-        # Cleanup forks
-        logger.info(f"Cleaning up {len(fork_ids)} forks...")
-        await fork_manager.cleanup_forks(fork_ids)
-        
     except Exception as e:
         logger.error(f"❌ Optimization task {task_id} failed: {e}")
         
@@ -287,8 +390,15 @@ async def run_optimization(task_id: str, code: str, language: str, num_agents: i
         )
         
         # Broadcast error
-        await manager.broadcast(task_id, {
-            "type": "error",
-            "task_id": task_id,
-            "error": str(e)
-        })
+        if manager.has_subscribers(task_id):
+            await manager.broadcast(task_id, {
+                "type": "error",
+                "task_id": task_id,
+                "error": str(e)
+            })
+    
+    finally:
+        # Cleanup forks, whether the task completed or failed
+        if fork_manager and fork_ids:
+            logger.info(f"Cleaning up {len(fork_ids)} forks...")
+            await fork_manager.cleanup_forks(fork_ids)
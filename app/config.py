@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List
+from functools import cached_property
+from typing import List, Optional
 import json
 
 
@@ -8,10 +9,25 @@ class Settings(BaseSettings):
     tiger_service_name: str
     tiger_database_url: str
     
+    # Tiger Cloud REST API (optional; paid-tier forks fall back to the tiger CLI
+    # unless project ID, base service ID and an access/secret key pair are all set)
+    tiger_api_url: str = "https://console.cloud.timescale.com/public/api/v1"
+    tiger_project_id: Optional[str] = None
+    tiger_service_id: Optional[str] = None  # ID of the tiger_service_name service
+    tiger_access_key: Optional[str] = None
+    tiger_secret_key: Optional[str] = None
+    
+    # Database Pool
+    db_pool_min_size: int = 10
+    db_pool_max_size: int = 50  # Hard cap on pool connections; keep below the server's max_connections
+    
     # Google Gemini API
     gemini_api_key: str
     gemini_model: str = "gemini-2.0-flash-exp"
     gemini_embedding_model: str = "gemini-embedding-001"
+    gemini_embedding_dimensions: int = 768  # Must match optimization_patterns.embedding vector(768)
+    gemini_batch_size: int = 4  # Agent prompts per Gemini request (capped by the output budget); smaller batches stream results sooner
+    gemini_latency_optimized: bool = True  # Smaller output budget, single low-temperature candidate
     
     # Application Settings
     env: str = "development"
@@ -24,12 +40,15 @@ class Settings(BaseSettings):
     # Fork Configuration
     tiger_use_virtual_forks: bool = True  # Free tier uses virtual forks
     max_concurrent_forks: int = 100
+    fork_concurrency: int = 8  # Fork create/delete calls in flight at once
     fork_timeout_seconds: int = 300
     fork_cleanup_enabled: bool = True
+    fork_sharing_enabled: bool = True  # Agents of the same strategy share a virtual fork
     
     # Agent Configuration
     default_num_agents: int = 50
     agent_timeout_seconds: int = 180
+    max_concurrent_tasks: int = 2  # Optimization tasks allowed to run at once
     
     # Redis (optional)
     redis_url: str = "redis://localhost:6379"
@@ -45,9 +64,9 @@ class Settings(BaseSettings):
         extra="ignore"
     )
     
-    @property
+    @cached_property
     def allowed_origins_list(self) -> List[str]:
-        """Parse allowed_origins from JSON string to list"""
+        """Parse allowed_origins from JSON string to list (parsed once)"""
         try:
             return json.loads(self.allowed_origins)
         except:
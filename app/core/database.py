@@ -5,19 +5,45 @@ from typing import Optional, List
 logger = logging.getLogger(__name__)
 
 
+def _encode_vector(value) -> str:
+    """Encode a list of floats in pgvector's text form, e.g. [1,2,3]"""
+    return '[' + ','.join(map(str, value)) + ']'
+
+
+def _decode_vector(value: str) -> List[float]:
+    """Decode pgvector's text form into a list of floats"""
+    return [float(x) for x in value[1:-1].split(',')] if len(value) > 2 else []
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Register codecs on each new pool connection"""
+    # asyncpg has no built-in codec for pgvector's vector type; without one,
+    # binding a Python list to a ::vector parameter fails
+    try:
+        await conn.set_type_codec(
+            'vector', encoder=_encode_vector, decoder=_decode_vector,
+            schema='public', format='text'
+        )
+    except ValueError:
+        logger.warning("pgvector 'vector' type not found; vector search unavailable")
+
+
 class DatabasePool:
     """Async PostgreSQL connection pool manager"""
     
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
     
-    async def connect(self, dsn: str):
+    async def connect(self, dsn: str, min_size: int, max_size: int):
         """Create connection pool"""
         try:
             self.pool = await asyncpg.create_pool(
                 dsn=dsn,
-                min_size=10,
-                max_size=50,
+                min_size=min_size,
+                max_size=max_size,
+                statement_cache_size=1024,
+                max_inactive_connection_lifetime=300,
+                init=_init_connection,
                 command_timeout=60,
                 timeout=30
             )
@@ -37,6 +63,11 @@ class DatabasePool:
         async with self.pool.acquire() as conn:
             return await conn.execute(query, *args)
     
+    async def copy_records_to_table(self, table: str, records: List[tuple], columns: List[str]) -> str:
+        """Bulk-load rows into a table over the binary COPY protocol"""
+        async with self.pool.acquire() as conn:
+            return await conn.copy_records_to_table(table, records=records, columns=columns)
+    
     async def fetch(self, query: str, *args) -> List[asyncpg.Record]:
         """Fetch multiple rows"""
         async with self.pool.acquire() as conn:
@@ -1,11 +1,18 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+import asyncio
+import orjson
 import logging
-from typing import Dict, List
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
 
 from app.config import settings
 from app.core.database import db
+from app.services.fork_manager import close_api_client
+from app.services.gemini_service import gemini_service
 
 # Configure logging
 logging.basicConfig(
@@ -15,41 +22,113 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def start_log_listener() -> QueueListener:
+    """
+    Move the root logger's handlers behind a QueueListener thread
+    
+    Log calls on the event loop then only enqueue the record; the listener
+    thread does the formatting and stream writes.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    listener = QueueListener(log_queue, *root_logger.handlers, respect_handler_level=True)
+    root_logger.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+
+def stop_log_listener(listener: QueueListener):
+    """Flush and stop the listener, handing its handlers back to the root logger"""
+    listener.stop()
+    logging.getLogger().handlers = list(listener.handlers)
+
+
+# Messages buffered per connection before a slow client is dropped
+SEND_QUEUE_SIZE = 256
+
+
+@dataclass
+class ConnEntry:
+    """A subscribed WebSocket with its own send queue and writer task"""
+    websocket: WebSocket
+    send_q: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=SEND_QUEUE_SIZE))
+    writer_task: Optional[asyncio.Task] = None
+    evicted: bool = False
+
+
 class ConnectionManager:
     """Manage WebSocket connections for real-time updates"""
     
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        # task_id -> id(websocket) -> connection entry
+        self.active_connections: Dict[str, Dict[int, ConnEntry]] = {}
+    
+    async def stop(self):
+        """Stop every connection's writer task"""
+        writers = [
+            entry.writer_task
+            for connections in self.active_connections.values()
+            for entry in connections.values()
+            if entry.writer_task
+        ]
+        for writer in writers:
+            writer.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
     
     async def connect(self, websocket: WebSocket, task_id: str):
         """Accept and register a WebSocket connection"""
         await websocket.accept()
-        if task_id not in self.active_connections:
-            self.active_connections[task_id] = []
-        self.active_connections[task_id].append(websocket)
+        entry = ConnEntry(websocket)
+        entry.writer_task = asyncio.create_task(self._writer(entry, task_id))
+        self.active_connections.setdefault(task_id, {})[id(websocket)] = entry
         logger.info(f"WebSocket connected for task: {task_id}")
     
     def disconnect(self, websocket: WebSocket, task_id: str):
         """Remove a WebSocket connection"""
-        if task_id in self.active_connections:
-            self.active_connections[task_id].remove(websocket)
-            if not self.active_connections[task_id]:
-                del self.active_connections[task_id]
+        connections = self.active_connections.get(task_id)
+        if connections is None:
+            return
+        entry = connections.pop(id(websocket), None)
+        if entry and entry.writer_task and entry.writer_task is not asyncio.current_task():
+            entry.writer_task.cancel()
+        if not connections:
+            del self.active_connections[task_id]
+    
+    def has_subscribers(self, task_id: str) -> bool:
+        """Whether any WebSocket is subscribed to a task"""
+        return bool(self.active_connections.get(task_id))
     
     async def broadcast(self, task_id: str, message: dict):
-        """Send message to all connections for a task"""
-        if task_id in self.active_connections:
-            disconnected = []
-            for websocket in self.active_connections[task_id]:
-                try:
-                    await websocket.send_json(message)
-                except Exception as e:
-                    logger.warning(f"Failed to send message: {e}")
-                    disconnected.append(websocket)
-            
-            # Clean up disconnected clients
-            for ws in disconnected:
-                self.disconnect(ws, task_id)
+        """Queue message for all connections of a task without waiting on network I/O"""
+        connections = self.active_connections.get(task_id)
+        if not connections:
+            return
+        
+        # Serialize once; every subscriber's queue shares the same bytes object
+        payload = orjson.dumps(message)
+        for entry in list(connections.values()):
+            try:
+                entry.send_q.put_nowait(payload)
+            except asyncio.QueueFull:
+                # Drop the slow client rather than block everyone else on it
+                logger.warning(f"Send queue full, dropping slow WebSocket for task: {task_id}")
+                entry.evicted = True
+                self.disconnect(entry.websocket, task_id)
+    
+    async def _writer(self, entry: ConnEntry, task_id: str):
+        """Send queued messages to one connection until it fails or is removed"""
+        try:
+            while True:
+                payload = await entry.send_q.get()
+                await entry.websocket.send_bytes(payload)
+        except asyncio.CancelledError:
+            if entry.evicted:
+                with suppress(Exception):
+                    await entry.websocket.close(code=1008)
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to send message: {e}")
+            self.disconnect(entry.websocket, task_id)
 
 
 # Global WebSocket manager
@@ -59,23 +138,35 @@ manager = ConnectionManager()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
-    # Startup
-    logger.info("🚀 Starting ParallelProof...")
-    logger.info(f"Environment: {settings.env}")
-    logger.info(f"Debug mode: {settings.debug}")
-    
+    log_listener = start_log_listener()
     try:
-        await db.connect(settings.tiger_database_url)
-        logger.info("Database connection established")
-    except Exception as e:
-        logger.error(f"Failed to connect to database: {e}")
-        raise
-    
-    yield
-    
-    # Shutdown
-    logger.info("Shutting down ParallelProof...")
-    await db.disconnect()
+        # Startup
+        logger.info("🚀 Starting ParallelProof...")
+        logger.info(f"Environment: {settings.env}")
+        logger.info(f"Debug mode: {settings.debug}")
+        
+        try:
+            await db.connect(
+                settings.tiger_database_url,
+                min_size=settings.db_pool_min_size,
+                max_size=settings.db_pool_max_size
+            )
+            logger.info("Database connection established")
+        except Exception as e:
+            logger.error(f"Failed to connect to database: {e}")
+            raise
+        
+        yield
+        
+        # Shutdown: run every step even if an earlier one fails
+        logger.info("Shutting down ParallelProof...")
+        for step in (manager.stop, db.disconnect, gemini_service.aclose, close_api_client):
+            try:
+                await step()
+            except Exception:
+                logger.exception(f"Shutdown step {step.__qualname__} failed")
+    finally:
+        stop_log_listener(log_listener)
 
 
 # Create FastAPI app
@@ -106,15 +197,15 @@ async def websocket_endpoint(websocket: WebSocket, task_id: str):
     """WebSocket endpoint for real-time agent updates"""
     await manager.connect(websocket, task_id)
     try:
+        # Client frames are ignored; the server's ping/pong keeps the connection alive
         while True:
-            # Keep connection alive and receive any client messages
-            data = await websocket.receive_text()
-            logger.debug(f"Received from client: {data}")
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, task_id)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
         logger.info(f"WebSocket disconnected for task: {task_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
+    finally:
         manager.disconnect(websocket, task_id)
 
 
@@ -1,17 +1,51 @@
 """Tiger database fork manager - Supports both Free and Paid Tiers"""
 import asyncio
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 import os
 
+import httpx
+
+from app.config import settings
+
 logger = logging.getLogger(__name__)
 
+# Process-wide Tiger REST API client, shared by every task's ForkManager so
+# its connection pool outlives a single optimization run
+_api_client: Optional[httpx.AsyncClient] = None
+
+
+def get_api_client() -> Optional[httpx.AsyncClient]:
+    """Get the shared Tiger API client, creating it on first use (None unless fully configured)"""
+    global _api_client
+    if _api_client is None and all((
+        settings.tiger_project_id, settings.tiger_service_id,
+        settings.tiger_access_key, settings.tiger_secret_key
+    )):
+        # The API is project-scoped and authenticates with an access/secret key pair
+        _api_client = httpx.AsyncClient(
+            base_url=f"{settings.tiger_api_url.rstrip('/')}/projects/{settings.tiger_project_id}",
+            auth=(settings.tiger_access_key, settings.tiger_secret_key),
+            http2=True,
+            timeout=60.0
+        )
+    return _api_client
+
+
+async def close_api_client():
+    """Close the shared Tiger API client, if one was opened"""
+    global _api_client
+    if _api_client is not None:
+        await _api_client.aclose()
+        _api_client = None
+
 
 class ForkManager:
     """Manages database forks for parallel agent execution"""
     
     def __init__(self, base_service: str, use_virtual_forks: bool = None):
         self.base_service = base_service
+        # Fork name -> Tiger service ID to delete it by
         self.forks: Dict[str, str] = {}
         
         # Auto-detect tier or use explicit setting
@@ -21,6 +55,15 @@ class ForkManager:
         else:
             self.use_virtual_forks = use_virtual_forks
         
+        # Cap concurrent fork create/delete calls so large agent counts don't
+        # exhaust processes/FDs or trip Tiger API rate limits
+        self._fork_sem = asyncio.Semaphore(settings.fork_concurrency)
+        
+        # Paid tier: talk to the Tiger REST API when it is configured, instead
+        # of spawning the tiger CLI per operation. The API addresses services
+        # by ID, so forks are taken from settings.tiger_service_id
+        self._http = None if self.use_virtual_forks else get_api_client()
+        
         if self.use_virtual_forks:
             logger.warning(f"⚠️ Running on free tier - virtual forks enabled. All agents will use main database: {base_service}")
         else:
@@ -39,7 +82,7 @@ class ForkManager:
         if self.use_virtual_forks:
             # Free tier: Virtual fork (instant)
             fork_name = f"main-{agent_id}"
-            self.forks[fork_name] = agent_id
+            self.forks[fork_name] = self.base_service
             logger.info(f"✅ Agent {agent_id} assigned to main database (virtual fork)")
             return fork_name
         else:
@@ -47,20 +90,37 @@ class ForkManager:
             fork_name = f"agent-{agent_id}"
             
             try:
-                proc = await asyncio.create_subprocess_shell(
-                    f"tiger service fork {self.base_service} --last-snapshot --name {fork_name}",
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
+                async with self._fork_sem:
+                    if self._http:
+                        response = await self._http.post(
+                            f"/services/{settings.tiger_service_id}/forkService",
+                            json={"name": fork_name, "fork_strategy": "LAST_SNAPSHOT"}
+                        )
+                        if response.is_error:
+                            error_msg = response.text.strip()
+                            logger.error(f"Fork creation failed for {fork_name}: {error_msg}")
+                            raise Exception(f"Fork failed: {error_msg}")
+                        service_id = response.json().get("service_id")
+                        if not service_id:
+                            logger.warning(f"No service_id returned for fork {fork_name}; deleting by name")
+                            service_id = fork_name
+                    else:
+                        proc = await asyncio.create_subprocess_exec(
+                            "tiger", "service", "fork", self.base_service,
+                            "--last-snapshot", "--name", fork_name,
+                            stdout=asyncio.subprocess.PIPE,
+                            stderr=asyncio.subprocess.PIPE
+                        )
+                        
+                        stdout, stderr = await proc.communicate()
+                        
+                        if proc.returncode != 0:
+                            error_msg = stderr.decode().strip()
+                            logger.error(f"Fork creation failed for {fork_name}: {error_msg}")
+                            raise Exception(f"Fork failed: {error_msg}")
+                        service_id = fork_name
                 
-                stdout, stderr = await proc.communicate()
-                
-                if proc.returncode != 0:
-                    error_msg = stderr.decode().strip()
-                    logger.error(f"Fork creation failed for {fork_name}: {error_msg}")
-                    raise Exception(f"Fork failed: {error_msg}")
-                
-                self.forks[fork_name] = agent_id
+                self.forks[fork_name] = service_id
                 logger.info(f"✅ Real fork created: {fork_name}")
                 return fork_name
                 
@@ -115,7 +175,7 @@ class ForkManager:
         Delete a fork (no-op on free tier, real delete on paid tier)
         
         Args:
-            fork_id: Fork name/ID to delete
+            fork_id: Fork name returned by create_fork
         """
         if self.use_virtual_forks:
             # Free tier: Just remove from tracking
@@ -123,15 +183,22 @@ class ForkManager:
                 del self.forks[fork_id]
             logger.info(f"🗑️ Removed virtual fork: {fork_id}")
         else:
-            # Paid tier: Delete real fork
+            # Paid tier: Delete real fork by the service ID recorded at creation
+            service_id = self.forks.get(fork_id, fork_id)
             try:
-                proc = await asyncio.create_subprocess_shell(
-                    f"tiger service delete {fork_id} --force",
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                
-                await proc.communicate()
+                async with self._fork_sem:
+                    if self._http:
+                        response = await self._http.delete(f"/services/{service_id}")
+                        if response.is_error:
+                            logger.warning(f"Fork deletion returned {response.status_code} for {fork_id}: {response.text.strip()}")
+                    else:
+                        proc = await asyncio.create_subprocess_exec(
+                            "tiger", "service", "delete", service_id, "--force",
+                            stdout=asyncio.subprocess.PIPE,
+                            stderr=asyncio.subprocess.PIPE
+                        )
+                        
+                        await proc.communicate()
                 
                 if fork_id in self.forks:
                     del self.forks[fork_id]
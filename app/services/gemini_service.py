@@ -1,14 +1,27 @@
 """Google Gemini API service"""
 from google import genai
 from google.genai import types
+import asyncio
 import logging
-import json
+import orjson
 import re
+from typing import List, Optional
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on output tokens for a single generate_content call
+MAX_OUTPUT_TOKENS = 8192
+# Output tokens budgeted per prompt (one full code rewrite), by mode
+PROMPT_OUTPUT_TOKENS = 4096
+PROMPT_OUTPUT_TOKENS_FAST = 1024
+# Maximum texts per embed_content request
+EMBED_BATCH_SIZE = 100
+
+# Leading/trailing markdown fences around the JSON payload (matched per line)
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.MULTILINE)
+
 
 class GeminiService:
     """Service for interacting with Google Gemini API"""
@@ -17,6 +30,12 @@ class GeminiService:
         self.client = genai.Client(api_key=settings.gemini_api_key)
         self.model = settings.gemini_model
         self.embedding_model = settings.gemini_embedding_model
+        self.embedding_dimensions = settings.gemini_embedding_dimensions
+        self.latency_optimized = settings.gemini_latency_optimized
+    
+    async def aclose(self):
+        """Close the async client's HTTP connection pool"""
+        await self.client.aio.aclose()
     
     async def optimize_code(self, prompt: str) -> dict:
         """
@@ -28,50 +47,22 @@ class GeminiService:
         Returns:
             dict with optimized_code, explanation, and improvement
         """
+        text = ""
         try:
-            response = self.client.models.generate_content(
+            response = await self.client.aio.models.generate_content(
                 model=self.model,
                 contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.7,
-                    max_output_tokens=4096,
-                    response_mime_type="application/json"
-                )
+                config=self._generation_config()
             )
             
             # Extract text from response
             text = response.text.strip()
+            parsed = self._parse_json(text)
+            result = self._normalize_result(parsed)
+            logger.info("✅ Gemini optimization successful")
+            return result
             
-            # Clean up any markdown code blocks if present
-            text = re.sub(r'```json\s*', '', text)
-            text = re.sub(r'```\s*', '', text)
-            text = text.strip()
-            
-            # Parse JSON
-            parsed = json.loads(text)
-
-            # Some prompts may produce a JSON array; prefer the first dict element
-            if isinstance(parsed, list):
-                if len(parsed) == 0:
-                    logger.warning("Gemini returned empty list for optimization result")
-                    return {"optimized_code": None, "explanation": "Empty result", "improvement": "0%"}
-                first = parsed[0]
-                if isinstance(first, dict):
-                    logger.info("✅ Gemini optimization returned a list; using first element")
-                    return first
-                else:
-                    logger.warning("Gemini returned a list but first element is not a dict; returning wrapped result")
-                    return {"optimized_code": str(first), "explanation": "Non-dict list item returned", "improvement": "0%"}
-
-            if isinstance(parsed, dict):
-                logger.info(f"✅ Gemini optimization successful")
-                return parsed
-
-            # Fallback: unexpected type
-            logger.warning(f"Gemini returned unexpected type: {type(parsed)}; wrapping result")
-            return {"optimized_code": str(parsed), "explanation": "Unexpected response type", "improvement": "0%"}
-            
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"JSON decode error: {e}")
             logger.error(f"Response text: {text[:500]}")
             return {
@@ -87,6 +78,131 @@ class GeminiService:
                 "improvement": "0%"
             }
     
+    async def optimize_batch(self, prompts: List[str]) -> List[dict]:
+        """
+        Send several optimization prompts to Gemini in a single request
+        
+        Prompts are marshaled into one request separated by numbered
+        ===AGENT_k=== delimiters and the model is asked to answer with a JSON
+        array holding one result per prompt. If the batched answer can't be
+        matched back to its prompts, each prompt is retried individually;
+        request errors are raised to the caller.
+        Keep len(prompts) <= max_batch_prompts so no answer is truncated.
+        
+        Args:
+            prompts: Optimization prompts, one per agent
+            
+        Returns:
+            List of result dicts in the same order as prompts
+        """
+        if not prompts:
+            return []
+        if len(prompts) == 1:
+            return [await self.optimize_code(prompts[0])]
+        
+        count = len(prompts)
+        sections = "\n\n".join(
+            f"===AGENT_{k}===\n{prompt}" for k, prompt in enumerate(prompts, 1)
+        )
+        batch_prompt = (
+            f"You will receive {count} independent optimization tasks, each starting "
+            f"with an ===AGENT_k=== marker. Answer every task on its own, following "
+            f"its instructions.\n"
+            f"Return ONLY a JSON array of exactly {count} objects (no markdown, no code blocks), "
+            f"where element k is the JSON object requested by ===AGENT_k===.\n\n"
+            f"{sections}"
+        )
+        
+        # API and transport errors (429, 5xx, timeouts) propagate so the caller
+        # fails these agents instead of fanning out count more requests
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=batch_prompt,
+            config=self._generation_config(num_prompts=count)
+        )
+        
+        try:
+            parsed = self._parse_json((response.text or "").strip())
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"Gemini batch response is not valid JSON ({e}); retrying {count} prompts individually")
+        else:
+            if isinstance(parsed, list) and len(parsed) == count:
+                logger.info(f"✅ Gemini batch optimization successful ({count} prompts)")
+                return [self._normalize_result(item) for item in parsed]
+            
+            logger.warning(
+                f"Gemini batch returned {len(parsed) if isinstance(parsed, list) else type(parsed).__name__} "
+                f"results for {count} prompts; retrying individually"
+            )
+        
+        return list(await asyncio.gather(*[self.optimize_code(prompt) for prompt in prompts]))
+    
+    @property
+    def max_batch_prompts(self) -> int:
+        """Most prompts one request can answer without shrinking any prompt's output budget"""
+        return max(1, MAX_OUTPUT_TOKENS // self._prompt_output_tokens)
+    
+    @property
+    def _prompt_output_tokens(self) -> int:
+        return PROMPT_OUTPUT_TOKENS_FAST if self.latency_optimized else PROMPT_OUTPUT_TOKENS
+    
+    def _generation_config(self, num_prompts: int = 1) -> types.GenerateContentConfig:
+        """
+        Build the generation config for a request answering num_prompts prompts
+        
+        In latency-optimized mode the output budget is tightened, a single
+        low-temperature candidate is requested and generation stops at a
+        trailing code fence, cutting decode time on the server.
+        """
+        if self.latency_optimized:
+            return types.GenerateContentConfig(
+                candidate_count=1,
+                temperature=0.2,
+                max_output_tokens=min(self._prompt_output_tokens * num_prompts, MAX_OUTPUT_TOKENS),
+                response_mime_type="application/json",
+                stop_sequences=["\n\n```"]
+            )
+        
+        return types.GenerateContentConfig(
+            temperature=0.7,
+            max_output_tokens=min(self._prompt_output_tokens * num_prompts, MAX_OUTPUT_TOKENS),
+            response_mime_type="application/json"
+        )
+    
+    def _embed_config(self) -> types.EmbedContentConfig:
+        """Request embeddings sized for the pattern table's vector column"""
+        return types.EmbedContentConfig(output_dimensionality=self.embedding_dimensions)
+    
+    @staticmethod
+    def _parse_json(text: str):
+        """Strip markdown code fences from model output and parse it as JSON"""
+        if '```' in text:
+            text = _FENCE_RE.sub('', text)
+        return orjson.loads(text.strip())
+    
+    @staticmethod
+    def _normalize_result(parsed) -> dict:
+        """Coerce a parsed Gemini response into a single result dict"""
+        # Some prompts may produce a JSON array; prefer the first dict element
+        if isinstance(parsed, list):
+            if len(parsed) == 0:
+                logger.warning("Gemini returned empty list for optimization result")
+                return {"optimized_code": None, "explanation": "Empty result", "improvement": "0%"}
+            first = parsed[0]
+            if isinstance(first, dict):
+                logger.info("✅ Gemini optimization returned a list; using first element")
+                return first
+            else:
+                logger.warning("Gemini returned a list but first element is not a dict; returning wrapped result")
+                return {"optimized_code": str(first), "explanation": "Non-dict list item returned", "improvement": "0%"}
+
+        if isinstance(parsed, dict):
+            return parsed
+
+        # Fallback: unexpected type
+        logger.warning(f"Gemini returned unexpected type: {type(parsed)}; wrapping result")
+        return {"optimized_code": str(parsed), "explanation": "Unexpected response type", "improvement": "0%"}
+    
     async def generate_embedding(self, text: str) -> list:
         """
         Generate embedding for semantic search
@@ -98,9 +214,10 @@ class GeminiService:
             List of floats representing the embedding vector
         """
         try:
-            response = self.client.models.embed_content(
+            response = await self.client.aio.models.embed_content(
                 model=self.embedding_model,
-                contents=text
+                contents=text,
+                config=self._embed_config()
             )
             
             # Extract embedding from response
@@ -114,7 +231,8 @@ class GeminiService:
                 embedding = response.values if hasattr(response, 'values') else None
             
             if embedding:
-                logger.debug(f"✅ Generated embedding for text (length: {len(text)}, dims: {len(embedding)})")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"✅ Generated embedding for text (length: {len(text)}, dims: {len(embedding)})")
                 return embedding
             else:
                 logger.error(f"No embedding found in response: {response}")
@@ -123,6 +241,41 @@ class GeminiService:
         except Exception as e:
             logger.error(f"Embedding error: {e}")
             return None
+    
+    async def generate_embeddings_batch(self, texts: List[str]) -> List[Optional[list]]:
+        """
+        Generate embeddings for many texts with one request per EMBED_BATCH_SIZE texts
+        
+        Args:
+            texts: Texts to generate embeddings for
+            
+        Returns:
+            Embedding vectors in input order (None where a batch failed)
+        """
+        chunks = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        chunk_results = await asyncio.gather(*[self._embed_chunk(chunk) for chunk in chunks])
+        return [embedding for chunk in chunk_results for embedding in chunk]
+    
+    async def _embed_chunk(self, texts: List[str]) -> List[Optional[list]]:
+        """Embed a single batch of texts, returning None for each on failure"""
+        try:
+            response = await self.client.aio.models.embed_content(
+                model=self.embedding_model,
+                contents=texts,
+                config=self._embed_config()
+            )
+            embeddings = [e.values for e in (response.embeddings or [])]
+            if len(embeddings) != len(texts):
+                logger.error(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+                return [None] * len(texts)
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"✅ Generated {len(embeddings)} embeddings in one request")
+            return embeddings
+            
+        except Exception as e:
+            logger.error(f"Batch embedding error: {e}")
+            return [None] * len(texts)
 
 
 # Global Gemini service instance
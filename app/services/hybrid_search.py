@@ -1,13 +1,85 @@
 """Hybrid search combining BM25 and vector similarity"""
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 import asyncpg
+from cachetools import TTLCache
 
 from app.core.database import db
 from app.services.gemini_service import gemini_service
 
 logger = logging.getLogger(__name__)
 
+# Query embeddings keyed by blake2b(model, dimensions, text); repeat queries
+# skip the Gemini RPC, and changing the embedding model never serves stale vectors
+_embedding_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+# In-flight loads by key, so concurrent identical queries share one RPC while
+# different texts load independently
+_embedding_loads: Dict[bytes, asyncio.Future] = {}
+
+
+async def _cached_embedding(text: str) -> Optional[List[float]]:
+    """
+    Get the embedding for text, checking the in-process and Postgres
+    caches before calling Gemini
+    
+    Args:
+        text: Text to embed
+        
+    Returns:
+        Embedding vector, or None if generation failed
+    """
+    key = hashlib.blake2b(
+        f"{gemini_service.embedding_model}:{gemini_service.embedding_dimensions}:{text}".encode(),
+        digest_size=16
+    ).digest()
+    
+    # No await between the cache check and registering the load, so this
+    # section is atomic on the event loop
+    embedding = _embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+    
+    load = _embedding_loads.get(key)
+    if load is None:
+        load = asyncio.ensure_future(_load_embedding(key, text))
+        _embedding_loads[key] = load
+        load.add_done_callback(lambda _: _embedding_loads.pop(key, None))
+    
+    # Shield so one cancelled caller doesn't cancel the load for the others
+    return await asyncio.shield(load)
+
+
+async def _load_embedding(key: bytes, text: str) -> Optional[List[float]]:
+    """Load an embedding from Postgres or Gemini and store it in both caches"""
+    embedding = None
+    
+    # Survive restarts: hot embeddings are also persisted in Postgres
+    try:
+        embedding = await db.fetchval(
+            "SELECT embedding FROM embedding_cache WHERE text_hash = $1", key
+        )
+    except Exception as e:
+        logger.warning(f"Embedding cache lookup failed: {e}")
+    
+    if embedding is None:
+        embedding = await gemini_service.generate_embedding(text)
+        if not embedding:
+            return None
+        try:
+            await db.execute(
+                """INSERT INTO embedding_cache (text_hash, embedding) VALUES ($1, $2)
+                   ON CONFLICT (text_hash) DO NOTHING""",
+                key, list(embedding)
+            )
+        except Exception as e:
+            logger.warning(f"Embedding cache store failed: {e}")
+    
+    embedding = list(embedding)
+    _embedding_cache[key] = embedding
+    return embedding
+
 
 async def hybrid_search(query_text: str, category: str, limit: int = 5) -> List[Dict]:
     """
@@ -24,69 +96,50 @@ async def hybrid_search(query_text: str, category: str, limit: int = 5) -> List[
     """
     try:
         # Generate embedding for vector search
-        query_embedding = await gemini_service.generate_embedding(query_text)
+        query_embedding = await _cached_embedding(query_text)
         
         if not query_embedding:
             # Fall back to BM25 only if embedding fails
             logger.warning("Embedding generation failed, using BM25 only")
             return await bm25_search(query_text, category, limit)
         
-        # BM25 keyword search
-        bm25_query = """
-            SELECT id, pattern_name, description, code_example,
-                   ts_rank(to_tsvector('english', description || ' ' || pattern_name), 
-                          plainto_tsquery('english', $1)) as bm25_score,
-                   ROW_NUMBER() OVER (ORDER BY ts_rank DESC) as rank
-            FROM optimization_patterns
-            WHERE category = $2
-              AND to_tsvector('english', description || ' ' || pattern_name) @@ plainto_tsquery('english', $1)
-            LIMIT 20
-        """
-        
-        bm25_results = await db.fetch(bm25_query, query_text, category)
-        
-        # Vector similarity search
-        vector_query = """
-            SELECT id, pattern_name, description, code_example,
-                   1 - (embedding <=> $1::vector) as vector_score,
-                   ROW_NUMBER() OVER (ORDER BY embedding <=> $1::vector) as rank
-            FROM optimization_patterns
-            WHERE category = $2 AND embedding IS NOT NULL
-            LIMIT 20
+        # BM25 keyword and vector similarity rankings fused with Reciprocal
+        # Rank Fusion (k = 60) in a single statement
+        query = """
+            WITH bm25 AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT id,
+                           ts_rank(tsv, plainto_tsquery('english', $1)) AS score
+                    FROM optimization_patterns
+                    WHERE category = $3
+                      AND tsv @@ plainto_tsquery('english', $1)
+                    ORDER BY score DESC
+                    LIMIT 20
+                ) scored
+            ),
+            vec AS (
+                -- ORDER BY distance + LIMIT lets the diskann index drive the scan
+                SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+                FROM (
+                    SELECT id, embedding <=> $2::vector AS distance
+                    FROM optimization_patterns
+                    WHERE category = $3 AND embedding IS NOT NULL
+                    ORDER BY distance
+                    LIMIT 20
+                ) nearest
+            )
+            SELECT p.id, p.pattern_name, p.description, p.code_example,
+                   COALESCE(1.0 / (60 + b.rank), 0) + COALESCE(1.0 / (60 + v.rank), 0) AS rrf_score
+            FROM bm25 b
+            FULL OUTER JOIN vec v USING (id)
+            JOIN optimization_patterns p ON p.id = COALESCE(b.id, v.id)
+            ORDER BY rrf_score DESC
+            LIMIT $4
         """
         
-        vector_results = await db.fetch(vector_query, query_embedding, category)
-        
-        # Combine using Reciprocal Rank Fusion (RRF)
-        combined = {}
-        k = 60  # RRF constant (standard value)
-        
-        # Add BM25 results
-        for row in bm25_results:
-            combined[row['id']] = {
-                'pattern': dict(row),
-                'rrf_score': 1 / (k + row['rank'])
-            }
-        
-        # Add vector results (combining scores if already exists)
-        for row in vector_results:
-            if row['id'] in combined:
-                combined[row['id']]['rrf_score'] += 1 / (k + row['rank'])
-            else:
-                combined[row['id']] = {
-                    'pattern': dict(row),
-                    'rrf_score': 1 / (k + row['rank'])
-                }
-        
-        # Sort by RRF score and return top results
-        sorted_results = sorted(
-            combined.values(), 
-            key=lambda x: x['rrf_score'], 
-            reverse=True
-        )
-        
-        # Extract just the pattern records and ensure they're proper dicts
-        top_patterns = [dict(r['pattern']) for r in sorted_results[:limit]]
+        rows = await db.fetch(query, query_text, query_embedding, category, limit)
+        top_patterns = [dict(row) for row in rows]
         
         logger.info(f"Hybrid search returned {len(top_patterns)} results for category: {category}")
         return top_patterns
@@ -97,6 +150,112 @@ async def hybrid_search(query_text: str, category: str, limit: int = 5) -> List[
         return await bm25_search(query_text, category, limit)
 
 
+async def hybrid_search_multi(query_text: str, categories: List[str], limit_per: int = 3) -> Dict[str, List[Dict]]:
+    """
+    Hybrid search for several categories in a single round trip
+    
+    Embeds query_text once and runs BM25 + vector ranking partitioned by
+    category, fusing them with Reciprocal Rank Fusion in SQL.
+    
+    Args:
+        query_text: Search query
+        categories: Strategy categories to search
+        limit_per: Number of results to return per category
+        
+    Returns:
+        Dict of category to list of optimization pattern records
+    """
+    results: Dict[str, List[Dict]] = {category: [] for category in categories}
+    if not categories:
+        return results
+    
+    try:
+        # Generate embedding for vector search (once for all categories)
+        query_embedding = await _cached_embedding(query_text)
+        
+        if not query_embedding:
+            # Fall back to BM25 only if embedding fails
+            logger.warning("Embedding generation failed, using BM25 only")
+            return await bm25_search_multi(query_text, categories, limit_per)
+        
+        query = """
+            WITH bm25 AS (
+                SELECT id, category,
+                       ROW_NUMBER() OVER (PARTITION BY category ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT id, category,
+                           ts_rank(tsv, plainto_tsquery('english', $1)) AS score
+                    FROM optimization_patterns
+                    WHERE category = ANY($3)
+                      AND tsv @@ plainto_tsquery('english', $1)
+                ) scored
+            ),
+            vec AS (
+                -- Per-category nearest neighbours via LATERAL so each ORDER BY
+                -- distance + LIMIT can be served by the diskann index
+                SELECT n.id, c.category,
+                       ROW_NUMBER() OVER (PARTITION BY c.category ORDER BY n.distance) AS rank
+                FROM unnest($3::text[]) AS c(category)
+                CROSS JOIN LATERAL (
+                    SELECT id, embedding <=> $2::vector AS distance
+                    FROM optimization_patterns
+                    WHERE category = c.category AND embedding IS NOT NULL
+                    ORDER BY distance
+                    LIMIT 20
+                ) n
+            ),
+            fused AS (
+                SELECT id, category, SUM(1.0 / (60 + rank)) AS rrf_score
+                FROM (
+                    SELECT * FROM bm25 WHERE rank <= 20
+                    UNION ALL
+                    SELECT * FROM vec WHERE rank <= 20
+                ) ranked
+                GROUP BY id, category
+            ),
+            top AS (
+                SELECT id, rrf_score,
+                       ROW_NUMBER() OVER (PARTITION BY category ORDER BY rrf_score DESC) AS rn
+                FROM fused
+            )
+            SELECT p.id, p.category, p.pattern_name, p.description, p.code_example, t.rrf_score
+            FROM top t
+            JOIN optimization_patterns p ON p.id = t.id
+            WHERE t.rn <= $4
+            ORDER BY p.category, t.rn
+        """
+        
+        rows = await db.fetch(query, query_text, query_embedding, categories, limit_per)
+        for row in rows:
+            results[row['category']].append(dict(row))
+        
+        logger.info(f"Hybrid search returned {len(rows)} results for {len(categories)} categories")
+        return results
+        
+    except Exception as e:
+        logger.error(f"Hybrid multi-category search error: {e}")
+        # Fall back to BM25 search on error
+        return await bm25_search_multi(query_text, categories, limit_per)
+
+
+async def bm25_search_multi(query_text: str, categories: List[str], limit_per: int = 3) -> Dict[str, List[Dict]]:
+    """
+    BM25-only fallback for hybrid_search_multi
+    
+    Args:
+        query_text: Search query
+        categories: Strategy categories to search
+        limit_per: Number of results to return per category
+        
+    Returns:
+        Dict of category to list of optimization pattern records
+    """
+    category_results = await asyncio.gather(
+        *[bm25_search(query_text, category, limit_per) for category in categories]
+    )
+    return dict(zip(categories, category_results))
+
+
 async def bm25_search(query_text: str, category: str, limit: int = 5) -> List[Dict]:
     """
     BM25-only fallback search
@@ -114,9 +273,8 @@ async def bm25_search(query_text: str, category: str, limit: int = 5) -> List[Di
             SELECT id, pattern_name, description, code_example
             FROM optimization_patterns
             WHERE category = $1
-              AND to_tsvector('english', description || ' ' || pattern_name) @@ plainto_tsquery('english', $2)
-            ORDER BY ts_rank(to_tsvector('english', description || ' ' || pattern_name), 
-                            plainto_tsquery('english', $2)) DESC
+              AND tsv @@ plainto_tsquery('english', $2)
+            ORDER BY ts_rank(tsv, plainto_tsquery('english', $2)) DESC
             LIMIT $3
         """
         
@@ -49,9 +49,13 @@ export default function App() {
     if (!taskId) return;
 
     const ws = new WebSocket(`ws://localhost:8000/ws/${taskId}`);
+    // Backend sends pre-serialized JSON as binary frames
+    ws.binaryType = 'arraybuffer';
+    const decoder = new TextDecoder();
     
     ws.onmessage = (event) => {
-      const msg: WebSocketMessage = JSON.parse(event.data);
+      const raw = typeof event.data === 'string' ? event.data : decoder.decode(event.data);
+      const msg: WebSocketMessage = JSON.parse(raw);
       
       switch (msg.type) {
         case 'forks_created':
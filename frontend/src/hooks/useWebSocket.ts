@@ -26,6 +26,9 @@ export function useWebSocket(taskId: string | null) {
 
     // Connect to WebSocket
     const ws = new WebSocket(`${WS_BASE_URL}/ws/${taskId}`);
+    // Backend sends pre-serialized JSON as binary frames
+    ws.binaryType = 'arraybuffer';
+    const decoder = new TextDecoder();
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -34,7 +37,8 @@ export function useWebSocket(taskId: string | null) {
     };
 
     ws.onmessage = (event) => {
-      const message: WebSocketMessage = JSON.parse(event.data);
+      const raw = typeof event.data === 'string' ? event.data : decoder.decode(event.data);
+      const message: WebSocketMessage = JSON.parse(raw);
       console.log('WebSocket message:', message);
 
       setMessages((prev) => [...prev, message]);
@@ -0,0 +1,5 @@
+-- Partial index backing the best-result lookup in get_task_status
+-- CONCURRENTLY cannot run inside a transaction block; apply this file on its own
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_agent_results_best ON agent_results
+    (task_id, improvement_percent DESC NULLS LAST)
+    WHERE status = 'completed' AND improvement_percent > 0;
@@ -0,0 +1,3 @@
+-- Source code is already stored once per task in optimization_tasks.original_code;
+-- duplicating it on every agent row bloated agent_results and its WAL traffic
+ALTER TABLE agent_results DROP COLUMN IF EXISTS original_code;
@@ -0,0 +1,7 @@
+-- Persistent cache of query embeddings, keyed by blake2b(model:dimensions:text)
+-- Stored as REAL[] so asyncpg reads and writes plain float lists
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    text_hash BYTEA PRIMARY KEY,
+    embedding REAL[] NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
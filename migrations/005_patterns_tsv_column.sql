@@ -0,0 +1,9 @@
+-- Stored tsvector for BM25 search so queries stop re-tokenizing every row
+ALTER TABLE optimization_patterns
+    ADD COLUMN IF NOT EXISTS tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', description || ' ' || pattern_name)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_patterns_tsv ON optimization_patterns USING GIN (tsv);
+
+-- Superseded by idx_patterns_tsv
+DROP INDEX IF EXISTS idx_patterns_fts;
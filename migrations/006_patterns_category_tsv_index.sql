@@ -0,0 +1,8 @@
+-- Composite GIN so BM25's "category = $n AND tsv @@ query" is answered by one index
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+CREATE INDEX IF NOT EXISTS idx_patterns_category_tsv ON optimization_patterns
+    USING GIN (category, tsv);
+
+-- Every BM25 query filters by category, so the tsv-only index is superseded
+DROP INDEX IF EXISTS idx_patterns_tsv;
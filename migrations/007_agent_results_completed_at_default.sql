@@ -0,0 +1,3 @@
+-- Stamp agent_results.completed_at on the server at insert time, like
+-- created_at, instead of sending a client-side timestamp with every COPY row
+ALTER TABLE agent_results ALTER COLUMN completed_at SET DEFAULT NOW();
@@ -12,7 +12,7 @@ timeout /t 2 /nobreak > nul
 
 echo.
 echo Starting Backend Server...
-start "ParallelProof Backend" cmd /k "cd /d %~dp0 && python -m uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload"
+start "ParallelProof Backend" cmd /k "cd /d %~dp0 && python -m uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload --ws-ping-interval 20"
 
 echo Waiting for backend to start...
 timeout /t 5 /nobreak > nul